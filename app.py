@@ -8,9 +8,11 @@
 并将UI事件（如按钮点击）与后端功能连接起来。
 """
 
+import asyncio
 import gradio as gr
 from pathlib import Path
 import pandas as pd
+import shutil
 import time
 
 # 从解耦后的模块中导入各自的类
@@ -20,82 +22,152 @@ from video_generator import VideoGenerator
 
 # --- Gradio UI 状态管理 ---
 chapter_data_state = gr.State([])
-selected_chapter_text_state = gr.State("")
+# 已选中章节在 chapter_data_state 中的索引，支持多选
+selected_chapters_state = gr.State([])
 
 # --- Gradio 配置项 ---
 COMFYUI_ADDRESS = "127.0.0.1:8188"
 COMFYUI_WORKFLOW_FILE = Path("workflow_video.json")
+# 每个事件允许同时处理的请求数；处理函数均为异步，等待LLM/ComfyUI时不会阻塞其他用户
+UI_CONCURRENCY_LIMIT = 4
 
 # --- Gradio 事件处理函数 ---
 
-def process_book_request(
+def _format_page_results(knowledge_list: list, in_progress: bool = False) -> str:
+    """将逐页分析结果渲染为Markdown，按页码排序；分析进行中时在标题下方提示已完成的页数。"""
+    output_md = "## 逐页分析结果\n\n"
+    if in_progress: output_md += f"⏳ 已分析 {len(knowledge_list)} 页，其余页面仍在分析中...\n\n"
+    for item in sorted(knowledge_list, key=lambda item: item['page']):
+        output_md += f"### 📄 第 {item['page']} 页\n\n**摘要:** {item['summary']}\n\n**关键点:**\n" + "".join([f"- {p}\n" for p in item['key_points']]) + "\n---\n"
+    return output_md
+
+def _chapter_table(chapter_data: list, selected_chapters: list) -> pd.DataFrame:
+    """生成章节列表的表格，第一列标记已选中的章节。"""
+    return pd.DataFrame({
+        "Selected": ["✅" if i in selected_chapters else "" for i in range(len(chapter_data))],
+        "Chapter Title": [ch["Chapter Title"] for ch in chapter_data],
+        "Page Range": [ch["Page Range"] for ch in chapter_data],
+    })
+
+def _visualize_label(selected_chapters: list) -> str:
+    """视频生成按钮的文字，显示已选择的章节数。"""
+    if not selected_chapters: return "生成章节视频 (请先选择章节)"
+    return f"生成章节视频 (已选择 {len(selected_chapters)} 个章节)"
+
+async def process_book_request(
     pdf_file, analysis_type, start_page, end_page, api_key, progress=gr.Progress()
 ):
-    """主处理函数，协调分析流程。"""
+    """主处理函数，协调分析流程；以生成器的形式逐步把结果推送到界面。"""
     if not api_key: raise gr.Error("需要提供Google API密钥才能继续。")
     if pdf_file is None: raise gr.Error("请先上传一个PDF文件进行分析。")
 
     work_dir = Path("temp_processing"); work_dir.mkdir(exist_ok=True)
     pdf_path = work_dir / Path(pdf_file.name).name
-    pdf_path.write_bytes(pdf_file.read())
+    # Gradio已将上传文件写入磁盘，直接复制文件，无需把整个PDF读入内存
+    await asyncio.to_thread(shutil.copy, pdf_file.name, pdf_path)
 
-    # 定义一个通用的“重置”状态，用于隐藏视频播放器
-    hide_video = gr.update(visible=False)
+    # 定义一个通用的“重置”状态：清空章节列表和选择，隐藏视频播放器，并重置视频按钮的文字
+    no_chapters = (None, None, gr.update(value=[]), [], gr.update(visible=False), gr.update(value=_visualize_label([])))
 
     try:
-        if analysis_type == "转换为完整Markdown (使用Marker)":
-            converter = PDFConverter(pdf_path=pdf_path)
-            markdown_content = converter.to_markdown()
-            # 返回6个值，与outputs列表匹配
-            return markdown_content, None, None, gr.update(value=[]), "", hide_video
+        if analysis_type == "转换为完整Markdown":
+            yield "🔄 正在将PDF转换为Markdown...", *no_chapters
+            # PDF解析属于CPU密集型操作，放到线程中执行，避免阻塞事件循环
+            converter = await asyncio.to_thread(PDFConverter, pdf_path=pdf_path)
+            markdown_content = await asyncio.to_thread(converter.to_markdown)
+            # 产出7个值，与outputs列表匹配
+            yield markdown_content, *no_chapters
+            return
 
         analyzer = BookAnalyzer(api_key=api_key)
         if analysis_type == "阅读并分析页面范围":
-            knowledge_list = analyzer.analyze_page_range(pdf_path, int(start_page), int(end_page))
-            if not knowledge_list: return "在指定页面范围内未提取到相关内容。", None, None, gr.update(value=[]), "", hide_video
-            output_md = "## 逐页分析结果\n\n"
-            for item in knowledge_list:
-                output_md += f"### 📄 第 {item['page']} 页\n\n**摘要:** {item['summary']}\n\n**关键点:**\n" + "".join([f"- {p}\n" for p in item['key_points']]) + "\n---\n"
-            # 返回6个值，与outputs列表匹配
-            return output_md, None, None, gr.update(value=[]), "", hide_video
+            yield "⏳ 正在分析页面...", *no_chapters
+            # 每完成一页就刷新一次界面，无需等待整个页面范围分析结束
+            knowledge_list = []
+            async for item in analyzer.iter_page_range_async(pdf_path, int(start_page), int(end_page)):
+                knowledge_list.append(item)
+                yield _format_page_results(knowledge_list, in_progress=True), *no_chapters
+            if not knowledge_list:
+                yield "在指定页面范围内未提取到相关内容。", *no_chapters
+                return
+            # 产出7个值，与outputs列表匹配
+            yield _format_page_results(knowledge_list), *no_chapters
 
         elif analysis_type == "通读全书并分割章节":
-            book_chapters = analyzer.segment_chapters(pdf_path)
-            if not book_chapters or not book_chapters.chapters: return "自动分割章节失败。", None, None, gr.update(value=[]), "", hide_video
+            yield "⏳ 正在通读全书并分割章节...", *no_chapters
+            book_chapters = await analyzer.segment_chapters_async(pdf_path)
+            if not book_chapters or not book_chapters.chapters:
+                yield "自动分割章节失败。", *no_chapters
+                return
             chapters_list = [{"Chapter Title": ch.title, "Page Range": f"{ch.start_page}–{ch.end_page}", "Chapter Summary": ch.summary} for ch in book_chapters.chapters]
-            display_df = pd.DataFrame({"Chapter Title": [ch["Chapter Title"] for ch in chapters_list], "Page Range": [ch["Page Range"] for ch in chapters_list]})
-            first_summary = chapters_list[0]['Chapter Summary'] if chapters_list else "没有摘要。"
-            # *** 修正 ***: 返回6个值，与outputs列表匹配
-            return "章节分割完成！请在下方选择一个章节查看详情。", display_df, first_summary, chapters_list, chapters_list[0]['Chapter Summary'], hide_video
+            # 产出7个值，与outputs列表匹配；初始不选中任何章节，由用户点击选择
+            yield (
+                "章节分割完成！请在下方点击章节选择要生成视频的章节，再次点击可取消选择。",
+                _chapter_table(chapters_list, []), "点击章节即可查看其摘要。", chapters_list, [], *no_chapters[-2:],
+            )
 
     except Exception as e:
         raise gr.Error(f"发生错误: {e}")
 
-def on_select_chapter(evt: gr.SelectData, chapter_data: list):
-    """当用户选择一个章节时的回调函数。"""
-    if evt.value is None or not chapter_data: return "请选择一个章节查看其摘要。", ""
-    selected_summary = chapter_data[evt.index[0]]['Chapter Summary']
-    return selected_summary, selected_summary
-
-def generate_video_request(chapter_text, api_key, progress=gr.Progress()):
-    """处理生成视频请求的函数。"""
+def on_select_chapter(evt: gr.SelectData, chapter_data: list, selected_chapters: list):
+    """当用户点击一个章节时的回调函数，切换该章节的选中状态，并刷新章节列表中的选中标记。"""
+    if evt.value is None or not chapter_data: return gr.update(), "请选择一个章节查看其摘要。", selected_chapters, gr.update()
+    index = evt.index[0]
+    if index in selected_chapters:
+        selected_chapters = [i for i in selected_chapters if i != index]
+        summary = f"已取消选择「{chapter_data[index]['Chapter Title']}」。"
+    else:
+        selected_chapters = sorted(selected_chapters + [index])
+        summary = chapter_data[index]['Chapter Summary']
+    return _chapter_table(chapter_data, selected_chapters), summary, selected_chapters, gr.update(value=_visualize_label(selected_chapters))
+
+async def generate_video_request(selected_chapters, chapter_data, preview_mode, api_key, progress=gr.Progress()):
+    """处理生成视频请求的函数，多个选中的章节会合并为一个视频；预览模式使用更低的步数和分辨率。"""
     if not api_key: raise gr.Error("需要提供Google API密钥才能继续。")
-    if not chapter_text: raise gr.Error("没有选定的章节内容。请先运行章节分割并选择一个章节。")
+    chapter_texts = [chapter_data[i]['Chapter Summary'] for i in selected_chapters]
+    if not chapter_texts: raise gr.Error("没有选定的章节内容。请先运行章节分割并选择至少一个章节。")
     if not COMFYUI_WORKFLOW_FILE.exists(): raise gr.Error(f"ComfyUI工作流文件未找到: {COMFYUI_WORKFLOW_FILE}。")
 
-    progress(0, desc="🚀 初始化视频生成器...")
+    status_log = ["🚀 初始化视频生成器..."]
+    yield gr.update(visible=False), gr.update(value="\n\n".join(status_log), visible=True)
+    video_generator = None
     try:
         video_generator = VideoGenerator(api_key, COMFYUI_ADDRESS, COMFYUI_WORKFLOW_FILE)
-        output_filename = f"chapter_video_{int(time.time())}"
-        final_video_path = video_generator.create_chapter_video(chapter_text, output_filename)
-        
+        mode = "preview" if preview_mode else "final"
+        output_filename = f"chapter_{mode}_{int(time.time())}"
+
+        # 生成器在工作线程中汇报进度，通过队列转交给事件循环
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        report = lambda message: loop.call_soon_threadsafe(messages.put_nowait, message)
+        # 视频生成内部使用线程等待ComfyUI，整体放到线程中执行
+        render = asyncio.ensure_future(asyncio.to_thread(video_generator.create_chapters_video, chapter_texts, output_filename, mode, report))
+
+        next_message = asyncio.ensure_future(messages.get())
+        try:
+            while True:
+                await asyncio.wait([render, next_message], return_when=asyncio.FIRST_COMPLETED)
+                if next_message.done():
+                    status_log.append(next_message.result())
+                    yield gr.update(), gr.update(value="\n\n".join(status_log))
+                    next_message = asyncio.ensure_future(messages.get())
+                elif render.done() and messages.empty():
+                    break
+        finally:
+            next_message.cancel()
+        final_video_path = render.result()
+
         if final_video_path:
-            return gr.update(value=str(final_video_path), visible=True)
+            status_log.append("✅ 视频生成完成！")
+            yield gr.update(value=str(final_video_path), visible=True), gr.update(value="\n\n".join(status_log))
         else:
             raise gr.Error("视频生成失败。请查看终端输出获取更多信息。")
             
     except Exception as e:
         raise gr.Error(f"视频生成过程中发生错误: {e}")
+    finally:
+        # 释放WebSocket长连接和后台线程
+        if video_generator: video_generator.close()
 
 # --- Gradio 界面定义 ---
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
@@ -107,7 +179,7 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
             api_key_box = gr.Textbox(label="输入你的Google API密钥", type="password", placeholder="以 'AIza...' 开头")
             pdf_upload = gr.File(label="上传PDF文件", file_types=[".pdf"])
             analysis_type_radio = gr.Radio(
-                ["阅读并分析页面范围", "通读全书并分割章节", "转换为完整Markdown (使用Marker)"],
+                ["阅读并分析页面范围", "通读全书并分割章节", "转换为完整Markdown"],
                 label="选择分析模式", value="阅读并分析页面范围"
             )
             with gr.Group(visible=True) as page_range_group:
@@ -120,29 +192,32 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
             gr.Markdown("## 📖 分析与可视化结果")
             output_markdown = gr.Markdown(label="内容概览或完整Markdown")
             
-            with gr.Accordion("章节列表 (点击选择)", open=True):
-                chapter_df = gr.DataFrame(headers=["章节标题", "页码范围"], datatype=["str", "str"], interactive=True)
+            with gr.Accordion("章节列表 (点击选择，可多选)", open=True):
+                chapter_df = gr.DataFrame(headers=["已选择", "章节标题", "页码范围"], datatype=["str", "str", "str"], interactive=False)
                 chapter_summary_text = gr.Textbox(label="选定章节的详细摘要", lines=8, interactive=False)
-                visualize_btn = gr.Button("生成章节视频 (Visualize Chapter)", variant="secondary")
+                with gr.Row():
+                    visualize_btn = gr.Button(_visualize_label([]), variant="secondary", scale=3)
+                    preview_mode_checkbox = gr.Checkbox(label="预览模式 (更少步数、更低分辨率)", value=False, scale=1)
 
+            video_status = gr.Markdown(visible=False)
             output_video = gr.Video(label="生成的章节故事视频", visible=False)
 
     submit_btn.click(
         fn=process_book_request,
         inputs=[pdf_upload, analysis_type_radio, start_page_num, end_page_num, api_key_box],
-        # *** 修正 ***: outputs列表现在包含6个组件，与函数的返回值数量匹配
-        outputs=[output_markdown, chapter_df, chapter_summary_text, chapter_data_state, selected_chapter_text_state, output_video]
+        # *** 修正 ***: outputs列表现在包含7个组件，与函数的产出值数量匹配
+        outputs=[output_markdown, chapter_df, chapter_summary_text, chapter_data_state, selected_chapters_state, output_video, visualize_btn]
     )
     chapter_df.select(
         fn=on_select_chapter,
-        inputs=[chapter_data_state],
-        outputs=[chapter_summary_text, selected_chapter_text_state]
+        inputs=[chapter_data_state, selected_chapters_state],
+        outputs=[chapter_df, chapter_summary_text, selected_chapters_state, visualize_btn]
     )
     visualize_btn.click(
         fn=generate_video_request,
-        inputs=[selected_chapter_text_state, api_key_box],
-        outputs=[output_video]
+        inputs=[selected_chapters_state, chapter_data_state, preview_mode_checkbox, api_key_box],
+        outputs=[output_video, video_status]
     )
 
 if __name__ == "__main__":
-    demo.launch(debug=True)
\ No newline at end of file
+    demo.queue(default_concurrency_limit=UI_CONCURRENCY_LIMIT).launch(debug=True)
\ No newline at end of file
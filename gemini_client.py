@@ -0,0 +1,72 @@
+# gemini_client.py
+
+"""
+Gemini客户端配置模块
+==============
+google-generativeai 的 genai.configure 是进程级的全局配置：它会替换所有模型随后取得的客户端。
+UI允许多个会话并发处理时，不同用户的请求可能因此以他人的密钥执行并计费。
+该模块为每个API密钥维护独立的客户端，供 text_analyzer 和 video_generator 共用；
+同一密钥在多次UI操作中重复使用时复用已创建的客户端。
+"""
+
+import contextlib
+import threading
+from typing import Any, Dict, Iterator
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+_client_managers: Dict[str, Any] = {}
+_managers_lock = threading.Lock()
+# caching 模块只能使用全局客户端，使用它的代码需要持有该锁
+_global_key_lock = threading.Lock()
+
+# bind_model 依赖的SDK内部属性（在 google-generativeai 0.8.6 上核对过）
+_MODEL_CLIENT_ATTRS = ("_client", "_async_client")
+
+def _get_client_manager(api_key: str) -> Any:
+    """获取该密钥专属的客户端管理器，不存在时创建。"""
+    with _managers_lock:
+        manager = _client_managers.get(api_key)
+        if manager is None:
+            manager_cls = getattr(genai_client, "_ClientManager", None)
+            if manager_cls is None:
+                raise RuntimeError("当前 google-generativeai 版本没有 client._ClientManager，无法为每个API密钥创建独立客户端；请安装 requirements.txt 中固定的版本。")
+            manager = manager_cls()
+            manager.configure(api_key=api_key)
+            _client_managers[api_key] = manager
+        return manager
+
+def bind_model(model: genai.GenerativeModel, api_key: str) -> genai.GenerativeModel:
+    """
+    让模型使用指定密钥的客户端，而不是全局默认客户端。
+
+    Args:
+        model (genai.GenerativeModel): 尚未发起过请求的模型对象。
+        api_key (str): 谷歌API密钥。
+
+    Returns:
+        genai.GenerativeModel: 传入的模型对象，便于链式调用。
+    """
+    # SDK内部属性改名后赋值不会报错，却会让请求悄悄回退到全局客户端（即其他用户的密钥），因此先显式检查
+    missing = [attr for attr in _MODEL_CLIENT_ATTRS if attr not in vars(model)]
+    if missing:
+        raise RuntimeError(f"当前 google-generativeai 版本的 GenerativeModel 缺少内部属性 {missing}，无法绑定独立客户端；请安装 requirements.txt 中固定的版本。")
+    if any(getattr(model, attr) is not None for attr in _MODEL_CLIENT_ATTRS):
+        raise RuntimeError("模型已经取得了客户端，只能绑定尚未发起过请求的模型。")
+    manager = _get_client_manager(api_key)
+    # GenerativeModel 在首次请求时才会取全局客户端，预先设置后就不再读取全局配置
+    model._client = manager.get_default_client("generative")
+    model._async_client = manager.get_default_client("generative_async")
+    return model
+
+@contextlib.contextmanager
+def global_api_key(api_key: str) -> Iterator[None]:
+    """
+    在持有锁期间把全局配置切换为指定密钥，供只能使用全局客户端的接口（如 caching）调用。
+
+    不同密钥的此类调用会被串行化；通过 bind_model 绑定的模型不受影响。
+    """
+    with _global_key_lock:
+        genai.configure(api_key=api_key)
+        yield
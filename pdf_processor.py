@@ -4,13 +4,24 @@
 PDF处理模块
 ==============
 该模块包含PDFConverter类，专门用于将PDF文档转换为Markdown格式。
-它使用了 marker-pdf 库来实现高精度的OCR和版面分析。
+对于自带文本层的PDF，直接使用 PyMuPDF 提取文本并根据字号推断标题；
+只有文本密度过低（例如扫描件）时，才使用 marker-pdf 进行OCR和版面分析。
 """
 
+from collections import Counter
 from pathlib import Path
-import marker
+from typing import Any, Dict, List
+
+import fitz
 from termcolor import colored
 
+# 每页平均字符数高于此值时认为PDF自带文本层，无需OCR
+TEXT_DENSITY_THRESHOLD = 200
+# 字号达到正文字号的该倍数时视为标题
+HEADING_SIZE_RATIO = 1.2
+# 超过该长度的文本块即使字号较大也不视为标题
+HEADING_MAX_CHARS = 120
+
 class PDFConverter:
     """
     处理PDF到Markdown的转换。
@@ -40,10 +51,64 @@ class PDFConverter:
             print(colored(f"♻️ 使用已缓存的Markdown文件: {self.md_path}", "blue"))
             return self.md_path.read_text(encoding='utf-8')
 
-        print(colored(f"🔄 使用Marker将PDF转换为Markdown... (这可能需要一些时间)", "cyan"))
-        # marker.convert_single_pdf 返回一个元组 (markdown_text, metadata)
-        markdown_text, _ = marker.convert_single_pdf(str(self.pdf_path))
+        # 只解析一次PDF：文本块既用于计算每页平均字符数（判断是否需要OCR），也用于生成Markdown
+        with fitz.open(self.pdf_path) as doc:
+            pages = [page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"] for page in doc]
+        text_density = sum(
+            len(span["text"].strip()) for blocks in pages for block in blocks for line in block.get("lines", []) for span in line["spans"]
+        ) / max(len(pages), 1)
+
+        if text_density > TEXT_DENSITY_THRESHOLD:
+            print(colored(f"⚡ PDF包含文本层 (平均每页 {text_density:.0f} 字符)，使用PyMuPDF直接提取...", "cyan"))
+            markdown_text = self._extract_markdown_with_fitz(pages)
+        else:
+            print(colored(f"🔄 使用Marker将PDF转换为Markdown... (这可能需要一些时间)", "cyan"))
+            # 仅在需要OCR时才导入marker，避免加载深度学习模型的开销
+            import marker
+            # marker.convert_single_pdf 返回一个元组 (markdown_text, metadata)
+            markdown_text, _ = marker.convert_single_pdf(str(self.pdf_path))
 
         self.md_path.write_text(markdown_text, encoding='utf-8')
         print(colored(f"✅ PDF成功转换为Markdown: {self.md_path}", "green"))
-        return markdown_text
\ No newline at end of file
+        return markdown_text
+
+    def _extract_markdown_with_fitz(self, pages: List[List[Dict[str, Any]]]) -> str:
+        """
+        使用PyMuPDF提取的文本层生成轻量的Markdown。
+
+        出现次数最多的字号视为正文字号，明显更大的字号按从大到小映射为一到三级标题。
+
+        Args:
+            pages: 每页 page.get_text("dict") 返回的文本块列表。
+
+        Returns:
+            str: PDF的Markdown内容。
+        """
+        # 统计每种字号覆盖的字符数
+        size_histogram = Counter()
+        for blocks in pages:
+            for block in blocks:
+                for line in block.get("lines", []):
+                    for span in line["spans"]:
+                        size_histogram[round(span["size"])] += len(span["text"].strip())
+
+        body_size = size_histogram.most_common(1)[0][0] if size_histogram else 0
+        heading_sizes = sorted((size for size in size_histogram if size >= body_size * HEADING_SIZE_RATIO), reverse=True)[:3]
+        heading_marks = {size: "#" * (level + 1) for level, size in enumerate(heading_sizes)}
+
+        md_blocks = []
+        for blocks in pages:
+            for block in blocks:
+                spans = [span for line in block.get("lines", []) for span in line["spans"]]
+                lines = ["".join(span["text"] for span in line["spans"]).strip() for line in block.get("lines", [])]
+                lines = [line for line in lines if line]
+                if not lines:
+                    continue
+
+                heading_mark = heading_marks.get(round(max(span["size"] for span in spans)))
+                if heading_mark and sum(len(line) for line in lines) <= HEADING_MAX_CHARS:
+                    md_blocks.append(f"{heading_mark} {' '.join(lines)}")
+                else:
+                    md_blocks.append("\n".join(lines))
+
+        return "\n\n".join(md_blocks)
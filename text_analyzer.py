@@ -6,18 +6,27 @@
 该模块包含BookAnalyzer类，负责与谷歌Gemini API直接交互，
 以执行文本分析任务，包括：
 - 按页面范围分析内容
-- 将整本书分割成逻辑章节
+- 将整本书分割成逻辑章节（长书会被切分成重叠的分块并发处理）
 """
 
-import json
+import asyncio
+import datetime
+import difflib
+import hashlib
+import re
+import zlib
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, FrozenSet, Set, Tuple
 
 import fitz
+import orjson
 import google.generativeai as genai # 移除了 langchain, 导入官方库
+from google.generativeai import caching
 from pydantic import BaseModel, Field
 from termcolor import colored
 
+from gemini_client import bind_model, global_api_key
+
 # --- Pydantic 模型定义 (保持不变) ---
 
 class PageKnowledge(BaseModel):
@@ -37,79 +46,409 @@ class BookChapters(BaseModel):
     """包含一本书所有章节的列表"""
     chapters: List[Chapter]
 
+# 模型的JSON Schema在导入时序列化一次，所有提示词直接复用
+PAGE_KNOWLEDGE_SCHEMA_JSON = orjson.dumps(PageKnowledge.model_json_schema(), option=orjson.OPT_INDENT_2).decode()
+BOOK_CHAPTERS_SCHEMA_JSON = orjson.dumps(BookChapters.model_json_schema(), option=orjson.OPT_INDENT_2).decode()
+
+# --- 缓存配置 ---
+
+CACHE_DIR = Path("temp_processing")
+# 记录 全文哈希 -> Gemini显式上下文缓存名称 的映射
+CONTEXT_CACHE_REGISTRY = CACHE_DIR / "gemini_cache.json"
+CONTEXT_CACHE_TTL = datetime.timedelta(seconds=600)
+# 显式缓存只支持固定版本的模型，不支持 "-latest" 之类的别名
+CONTEXT_CACHE_MODEL = "models/gemini-1.5-pro-002"
+# Gemini显式缓存要求的最小token数，低于此值直接发送全文
+CONTEXT_CACHE_MIN_TOKENS = 32_768
+# 本地估算的token数并不精确，留出余量，避免为刚好达到下限的文本发起注定失败的上传
+CONTEXT_CACHE_TOKEN_MARGIN = 1.2
+# 单页分析结果的持久化缓存目录
+ANALYSIS_CACHE_DIR = CACHE_DIR / "analysis_cache"
+# 逐页文本的缓存文件名模板，按PDF内容的哈希区分
+PAGES_CACHE_TEMPLATE = "pages_{}.json"
+
+# 创建显式缓存失败过的API密钥（记录哈希），本进程内不再重试，例如免费层级的密钥不支持显式缓存
+_context_cache_unavailable: Set[str] = set()
+
+def _pdf_hash(pdf_path: Path) -> str:
+    """计算PDF内容的SHA256，用作缓存键；分块读取文件，不会把整个PDF读入内存"""
+    with pdf_path.open('rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+# --- 页面过滤配置 ---
+
+# 少于该字符数的页面视为空白页
+MIN_PAGE_CHARS = 50
+# 仅有标题的页面：字符数和行数都很少，且不包含句末标点
+TITLE_PAGE_MAX_CHARS = 200
+TITLE_PAGE_MAX_LINES = 3
+# 与已分析页面的指纹相似度达到该值时视为重复页
+DUPLICATE_PAGE_SIMILARITY = 0.95
+# 生成页面指纹时使用的字符 n-gram 长度
+SHINGLE_SIZE = 5
+# MinHash签名的分桶数，以及LSH每个band包含的分桶数；只有至少一个band相同的页面才会精确比较相似度
+MINHASH_BINS = 32
+LSH_BAND_SIZE = 4
+
+_SENTENCE_END_PATTERN = re.compile(r"[。！？!?.…”\"]")
+# 生成指纹前去掉数字和空白，避免页码、排版差异影响比较
+_FINGERPRINT_STRIP_PATTERN = re.compile(r"[\d\s]+")
+
+def _is_title_page(page_text: str) -> bool:
+    """判断页面是否只包含章节标题等少量文字"""
+    text = page_text.strip()
+    lines = [line for line in text.splitlines() if line.strip()]
+    return len(text) <= TITLE_PAGE_MAX_CHARS and len(lines) <= TITLE_PAGE_MAX_LINES and not _SENTENCE_END_PATTERN.search(text)
+
+def _page_fingerprint(page_text: str) -> FrozenSet[int]:
+    """由页面文本的字符 n-gram 哈希组成的指纹集合"""
+    normalized = _FINGERPRINT_STRIP_PATTERN.sub("", page_text).lower()
+    return frozenset(
+        zlib.crc32(normalized[i:i + SHINGLE_SIZE].encode("utf-8"))
+        for i in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))
+    )
+
+def _fingerprint_similarity(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    """两个指纹集合的Jaccard相似度"""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _lsh_band_keys(fingerprint: FrozenSet[int]) -> List[Tuple[int, ...]]:
+    """
+    计算指纹的LSH分段键。
+
+    使用单次哈希的MinHash：按哈希值取模分桶，每个桶取最小值，再把相邻的 LSH_BAND_SIZE 个桶组成一个键。
+    """
+    signature = [0xFFFFFFFF] * MINHASH_BINS
+    for shingle_hash in fingerprint:
+        bin_index = shingle_hash % MINHASH_BINS
+        if shingle_hash < signature[bin_index]:
+            signature[bin_index] = shingle_hash
+    return [(start, *signature[start:start + LSH_BAND_SIZE]) for start in range(0, MINHASH_BINS, LSH_BAND_SIZE)]
+
+# --- 长书分块配置 ---
+
+# 每个分块的目标token数，以及相邻分块之间重叠的token数
+# 分块大小需高于显式缓存的下限（CONTEXT_CACHE_MIN_TOKENS * CONTEXT_CACHE_TOKEN_MARGIN），长书的各个分块才能各自缓存；
+# 只有不足下限的短书和长书的最后一个分块会直接发送全文
+CHUNK_TARGET_TOKENS = 60_000
+CHUNK_OVERLAP_TOKENS = 4_000
+# 同时分析的分块数上限
+CHUNK_CONCURRENCY = 4
+# 相邻分块中标题相似度达到该值的章节视为同一章节
+TITLE_MATCH_RATIO = 0.9
+# 分块的第一个章节起始页与分块起始页相差不超过该页数、且与上一章节重叠时，视为上一章节的延续
+CHUNK_START_TOLERANCE_PAGES = 2
+
+PAGE_ANALYSIS_INSTRUCTION = "你是一位文学分析师。你的任务是阅读单页书本内容，并以结构化JSON格式提取关键信息。请关注情节、人物、背景和重要对话。忽略目录或空白页等非故事内容。"
+CHAPTER_SEGMENT_INSTRUCTION = "你是一位专业的图书编辑。你的任务是阅读一本书的全文，并将其分割成逻辑清晰的章节。对于每个章节，请根据文本中的 `[Page X]` 标记，提供标题、详细摘要以及精确的起止页码。"
+
+_CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符约1个token，其余字符约4个对应1个token"""
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    return cjk_chars + (len(text) - cjk_chars) // 4
+
+# 比较标题前去掉标点、符号和空白，LLM生成的标题经常只在这些字符上有差异
+_TITLE_STRIP_PATTERN = re.compile(r"[\W_]+")
+
+def _titles_match(title_a: str, title_b: str) -> bool:
+    """
+    判断两个章节标题是否足够相似，忽略标点和空白的差异。
+
+    >>> _titles_match("第二章 远行", "第二章：远行")
+    True
+    """
+    normalized_a = _TITLE_STRIP_PATTERN.sub("", title_a).lower()
+    normalized_b = _TITLE_STRIP_PATTERN.sub("", title_b).lower()
+    return difflib.SequenceMatcher(None, normalized_a, normalized_b).ratio() >= TITLE_MATCH_RATIO
+
 # --- 服务类 ---
 
 class BookAnalyzer:
     """处理所有与LLM相关的书籍文本分析任务 (使用 google-generativeai)"""
-    def __init__(self, api_key: str):
-        # 配置官方库的API密钥
-        genai.configure(api_key=api_key)
+    def __init__(self, api_key: str, max_concurrency: int = 8):
+        # 模型使用该密钥专属的客户端，不依赖进程级的 genai.configure
+        self._api_key = api_key
+        self._api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
         self.model_name = "gemini-1.5-pro-latest"
         # 配置模型以强制输出JSON
         self.generation_config = genai.GenerationConfig(response_mime_type="application/json")
+        # 模型对象在所有分析任务之间复用
+        self.model = bind_model(genai.GenerativeModel(self.model_name, generation_config=self.generation_config), api_key)
+        # 并发请求的上限，避免触发Gemini的速率限制
+        self.max_concurrency = max_concurrency
+        # 固定的提示词前缀只构建一次，所有请求共享逐字节相同的开头，便于Gemini的隐式前缀缓存命中
+        self._page_prompt_prefix = self._create_prompt_prefix(PAGE_ANALYSIS_INSTRUCTION, PAGE_KNOWLEDGE_SCHEMA_JSON)
+        self._chapter_prompt_prefix = self._create_prompt_prefix(CHAPTER_SEGMENT_INSTRUCTION, BOOK_CHAPTERS_SCHEMA_JSON)
+
+    def _create_prompt_prefix(self, system_instruction: str, schema_json: str) -> str:
+        """创建提示词中不随输入变化的前缀（系统指令和JSON schema），schema_json 为预先序列化好的Schema"""
+        return f"{system_instruction}\n\n请严格按照下面的JSON Schema格式返回你的分析结果:\n{schema_json}\n\n需要分析的文本如下:\n---\n"
+
+    def _extract_pages(self, pdf_path: Path) -> List[str]:
+        """提取PDF的逐页文本；同一份PDF只解析一次，结果按内容哈希缓存在磁盘上。"""
+        cache_path = CACHE_DIR / PAGES_CACHE_TEMPLATE.format(_pdf_hash(pdf_path))
+        if cache_path.exists():
+            return orjson.loads(cache_path.read_bytes())
+
+        with fitz.open(pdf_path) as pdf_document:
+            pages = [page.get_text("text") for page in pdf_document]
+        CACHE_DIR.mkdir(exist_ok=True)
+        cache_path.write_bytes(orjson.dumps(pages))
+        return pages
+
+    def _get_context_cache(self, system_instruction: str, content: str) -> Optional[caching.CachedContent]:
+        """获取或创建全文的显式上下文缓存；内容过短或缓存不可用时返回None。caching 只能使用全局客户端，需在 global_api_key 中调用。"""
+        key = hashlib.sha256(f"{CONTEXT_CACHE_MODEL}\n{system_instruction}\n{content}".encode("utf-8")).hexdigest()
+        registry = orjson.loads(CONTEXT_CACHE_REGISTRY.read_bytes()) if CONTEXT_CACHE_REGISTRY.exists() else {}
+
+        if key in registry:
+            try:
+                cache = caching.CachedContent.get(registry[key])
+                cache.update(ttl=CONTEXT_CACHE_TTL)
+                print(colored(f"♻️ 复用Gemini上下文缓存: {cache.name}", "blue"))
+                return cache
+            except Exception:
+                # 缓存已过期或被删除，重新创建
+                registry.pop(key)
+
+        # 在本地估算token数，不为此额外调用一次 count_tokens
+        if self._api_key_hash in _context_cache_unavailable or _estimate_tokens(content) < CONTEXT_CACHE_MIN_TOKENS * CONTEXT_CACHE_TOKEN_MARGIN:
+            return None
+        try:
+            cache = caching.CachedContent.create(
+                model=CONTEXT_CACHE_MODEL,
+                system_instruction=system_instruction,
+                contents=[content],
+                ttl=CONTEXT_CACHE_TTL,
+            )
+        except Exception as e:
+            _context_cache_unavailable.add(self._api_key_hash)
+            print(colored(f"⚠️ 无法创建Gemini上下文缓存，将直接发送全文，本次运行不再尝试: {e}", "yellow"))
+            return None
+
+        registry[key] = cache.name
+        CONTEXT_CACHE_REGISTRY.parent.mkdir(exist_ok=True)
+        CONTEXT_CACHE_REGISTRY.write_bytes(orjson.dumps(registry, option=orjson.OPT_INDENT_2))
+        print(colored(f"📦 已创建Gemini上下文缓存: {cache.name}", "blue"))
+        return cache
+
+    async def _cached_analyze(self, page_num: int, page_text: str, force_refresh: bool = False) -> PageKnowledge:
+        """分析单页内容；相同模型、提示词前缀和页面文本的结果从磁盘缓存中读取。"""
+        key = hashlib.sha256((self.model_name + self._page_prompt_prefix + page_text).encode("utf-8")).hexdigest()
+        cache_path = ANALYSIS_CACHE_DIR / f"{key}.json"
+        if not force_refresh and cache_path.exists():
+            print(colored(f"♻️ 第 {page_num + 1} 页使用已缓存的分析结果。", "blue"))
+            return PageKnowledge.model_validate_json(cache_path.read_text(encoding='utf-8'))
 
-    def _create_prompt(self, system_instruction: str, user_content: str, schema: Dict) -> str:
-        """创建一个包含JSON schema的完整提示词"""
-        return f"{system_instruction}\n\n请严格按照下面的JSON Schema格式返回你的分析结果:\n{json.dumps(schema, indent=2)}\n\n需要分析的文本如下:\n---\n{user_content}"
+        # 固定前缀在前，只有页码和页面文本随请求变化
+        prompt = self._page_prompt_prefix + f"这是来自第 {page_num + 1} 页的内容:\n{page_text}"
+        # 异步调用API
+        response = await self.model.generate_content_async(prompt)
+        # 使用Pydantic解析和验证JSON，验证通过后才写入缓存
+        page_knowledge = PageKnowledge.model_validate_json(response.text)
+        ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(page_knowledge.model_dump_json(), encoding='utf-8')
+        return page_knowledge
 
-    def analyze_page_range(self, pdf_path: Path, start_page: int, end_page: int) -> List[Dict[str, Any]]:
-        """分析PDF中一个指定的页面范围。"""
-        model = genai.GenerativeModel(self.model_name, generation_config=self.generation_config)
-        pdf_document = fitz.open(pdf_path)
-        total_pages = pdf_document.page_count
+    def analyze_page_range(self, pdf_path: Path, start_page: int, end_page: int, force_refresh: bool = False) -> List[Dict[str, Any]]:
+        """分析PDF中一个指定的页面范围 (同步入口，内部并发执行)。"""
+        return asyncio.run(self.analyze_page_range_async(pdf_path, start_page, end_page, force_refresh=force_refresh))
+
+    async def analyze_page_range_async(self, pdf_path: Path, start_page: int, end_page: int, force_refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        并发分析PDF中一个指定的页面范围，并发数受 max_concurrency 限制。
+
+        force_refresh 为True时忽略已缓存的单页分析结果并重新调用API。
+        """
+        knowledge_base = [item async for item in self.iter_page_range_async(pdf_path, start_page, end_page, force_refresh=force_refresh)]
+        # 按页码排序，保持与顺序执行时一致的输出
+        return sorted(knowledge_base, key=lambda item: item["page"])
+
+    async def iter_page_range_async(
+        self, pdf_path: Path, start_page: int, end_page: int, force_refresh: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        并发分析页面范围，并按完成顺序逐个产出每页的分析结果。
+
+        调用方提前停止迭代时，尚未完成的页面分析任务会被取消。
+        """
+        # PDF解析属于CPU密集型操作，放到线程中执行，避免阻塞事件循环
+        pages = await asyncio.to_thread(self._extract_pages, pdf_path)
+        total_pages = len(pages)
         start_page = max(1, start_page)
         end_page = min(total_pages, end_page)
 
         if start_page > end_page:
             raise ValueError("起始页不能大于结束页。")
 
-        system_instruction = "你是一位文学分析师。你的任务是阅读单页书本内容，并以结构化JSON格式提取关键信息。请关注情节、人物、背景和重要对话。忽略目录或空白页等非故事内容。"
-        
-        knowledge_base = []
+        # 信号量需要在当前事件循环中创建，因此每次调用单独创建
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _analyze_page(page_num: int, page_text: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                print(colored(f"🧠 正在处理第 {page_num + 1}/{total_pages} 页...", "cyan"))
+                try:
+                    page_knowledge = await self._cached_analyze(page_num, page_text, force_refresh)
+                except Exception as e:
+                    print(colored(f"❌ 第 {page_num + 1} 页出错: {e}", "red"))
+                    return None
+
+            if not page_knowledge.has_relevant_content:
+                return None
+            print(colored(f"✅ 第 {page_num + 1} 页分析完毕。", "green"))
+            return {"page": page_num + 1, "summary": page_knowledge.page_summary, "key_points": page_knowledge.key_points}
+
         print(colored(f"\n📖 正在分析第 {start_page} 页到 {end_page} 页...", "yellow"))
+        # 页面过滤需要计算所有页面的指纹，同样放到线程中执行
+        page_nums = await asyncio.to_thread(self._select_pages, pages, start_page, end_page)
+        tasks = [asyncio.ensure_future(_analyze_page(page_num, pages[page_num])) for page_num in page_nums]
+
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                try:
+                    result = await next_result
+                except Exception as e:
+                    print(colored(f"❌ 页面分析任务出错: {e}", "red"))
+                    continue
+                if result:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
 
+    def _select_pages(self, pages: List[str], start_page: int, end_page: int) -> List[int]:
+        """
+        挑选页面范围内需要调用LLM分析的页面，跳过空白页、仅含标题的页面和与之前页面几乎相同的页面。
+
+        重复页面通过LSH分桶查找候选，只与共享至少一个分段键的页面精确比较，整体耗时与页数成线性关系。
+
+        Returns:
+            需要分析的页面索引列表（从0开始）。
+        """
+        selected = []
+        fingerprints: List[FrozenSet[int]] = []
+        buckets: Dict[Tuple[int, ...], List[int]] = {}
         for page_num in range(start_page - 1, end_page):
-            page_text = pdf_document[page_num].get_text("text")
-            if len(page_text.strip()) < 50:
+            page_text = pages[page_num]
+            if len(page_text.strip()) < MIN_PAGE_CHARS:
                 continue
-            
-            print(colored(f"🧠 正在处理第 {page_num + 1}/{total_pages} 页...", "cyan"))
-            try:
-                # 创建包含Schema的提示词
-                prompt = self._create_prompt(
-                    system_instruction,
-                    f"这是来自第 {page_num + 1} 页的内容:\n{page_text}",
-                    PageKnowledge.model_json_schema()
-                )
-                # 调用API
-                response = model.generate_content(prompt)
-                # 使用Pydantic解析和验证JSON
-                page_knowledge = PageKnowledge.model_validate_json(response.text)
-                
-                if page_knowledge.has_relevant_content:
-                    knowledge_base.append({"page": page_num + 1, "summary": page_knowledge.page_summary, "key_points": page_knowledge.key_points})
-                    print(colored(f"✅ 第 {page_num + 1} 页分析完毕。", "green"))
-            except Exception as e:
-                print(colored(f"❌ 第 {page_num + 1} 页出错: {e}", "red"))
-
-        return knowledge_base
+            if _is_title_page(page_text):
+                print(colored(f"⏭️  跳过第 {page_num + 1} 页 (仅包含标题)", "yellow"))
+                continue
+            # 与范围内已提交分析的页面几乎相同的页面不再调用LLM
+            fingerprint = _page_fingerprint(page_text)
+            band_keys = _lsh_band_keys(fingerprint)
+            candidates = {index for key in band_keys for index in buckets.get(key, ())}
+            if any(_fingerprint_similarity(fingerprint, fingerprints[index]) >= DUPLICATE_PAGE_SIMILARITY for index in candidates):
+                print(colored(f"⏭️  跳过第 {page_num + 1} 页 (与之前的页面内容重复)", "yellow"))
+                continue
+            for key in band_keys:
+                buckets.setdefault(key, []).append(len(fingerprints))
+            fingerprints.append(fingerprint)
+            selected.append(page_num)
+        return selected
 
-    def segment_chapters(self, pdf_path: Path) -> Optional[BookChapters]:
-        """分析整本书以识别和分割章节。"""
-        model = genai.GenerativeModel(self.model_name, generation_config=self.generation_config)
-        pdf_document = fitz.open(pdf_path)
-        full_text = "".join([f"\n\n[Page {i + 1}]\n\n{page.get_text('text')}" for i, page in enumerate(pdf_document)])
-        
-        system_instruction = "你是一位专业的图书编辑。你的任务是阅读一本书的全文，并将其分割成逻辑清晰的章节。对于每个章节，请根据文本中的 `[Page X]` 标记，提供标题、详细摘要以及精确的起止页码。"
-        
+    def _chunk_pages(
+        self, pages: List[str], target_tokens: int = CHUNK_TARGET_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+    ) -> List[Tuple[int, int, str]]:
+        """
+        将逐页文本切分成相互重叠的分块。
+
+        Returns:
+            (起始页, 结束页, 带 `[Page X]` 标记的文本) 的列表，页码从1开始。
+        """
+        page_tokens = [_estimate_tokens(page_text) for page_text in pages]
+        chunks = []
+        start = 0
+        while start < len(pages):
+            end, tokens = start, 0
+            while end < len(pages) and (end == start or tokens + page_tokens[end] <= target_tokens):
+                tokens += page_tokens[end]
+                end += 1
+            chunk_text = "".join(f"\n\n[Page {i + 1}]\n\n{pages[i]}" for i in range(start, end))
+            chunks.append((start + 1, end, chunk_text))
+            if end >= len(pages):
+                break
+
+            # 下一块从当前块末尾回退约 overlap_tokens 的页面开始，但至少前进一页
+            next_start, overlap = end, 0
+            while next_start > start + 1 and overlap + page_tokens[next_start - 1] <= overlap_tokens:
+                next_start -= 1
+                overlap += page_tokens[next_start]
+            start = next_start
+        return chunks
+
+    def _merge_chapters(self, chunk_chapters: List[Tuple[int, List[Chapter]]]) -> List[Chapter]:
+        """
+        按页码顺序合并各分块识别出的章节，消除重叠区域造成的重复和边界冲突。
+
+        Args:
+            chunk_chapters: (分块起始页, 该分块识别出的章节) 的列表，按分块顺序排列。
+        """
+        merged: List[Chapter] = []
+        for chunk_start, chapters in chunk_chapters:
+            for index, chapter in enumerate(sorted(chapters, key=lambda c: c.start_page)):
+                if not merged:
+                    merged.append(chapter)
+                    continue
+                last = merged[-1]
+                # 在分块开头被截断的章节会从分块起始页开始报告，标题由LLM生成，不一定与上一块一致
+                if index == 0 and chapter.start_page <= chunk_start + CHUNK_START_TOLERANCE_PAGES:
+                    covering = next((i for i in range(len(merged) - 1, -1, -1) if merged[i].start_page <= chapter.start_page <= merged[i].end_page), None)
+                    if covering is not None and covering < len(merged) - 1 and chapter.end_page <= last.end_page:
+                        # 截断的部分属于更早的章节，其页码已被覆盖，只补充摘要；重叠区域内的章节边界以前一块为准
+                        target = merged[covering]
+                        merged[covering] = target.model_copy(update={"summary": f"{target.summary}\n{chapter.summary}"})
+                        continue
+                    continues_last = covering is not None
+                else:
+                    continues_last = False
+                if continues_last or (last.start_page <= chapter.start_page <= last.end_page + 1 and _titles_match(last.title, chapter.title)):
+                    # 同一章节跨越了分块边界，合并页码范围和两部分摘要
+                    merged[-1] = Chapter(
+                        title=last.title,
+                        summary=f"{last.summary}\n{chapter.summary}",
+                        start_page=last.start_page,
+                        end_page=max(last.end_page, chapter.end_page),
+                    )
+                elif chapter.end_page <= last.end_page:
+                    # 完全落在上一章节范围内，是重叠区域中重复识别出的章节
+                    continue
+                elif chapter.start_page <= last.start_page:
+                    # 完全覆盖上一章节，以上下文更完整的后一块结果为准
+                    merged[-1] = chapter
+                elif chapter.start_page <= last.end_page:
+                    # 边界冲突时以后一块识别出的起始页为准
+                    merged[-1] = last.model_copy(update={"end_page": chapter.start_page - 1})
+                    merged.append(chapter)
+                else:
+                    merged.append(chapter)
+        return merged
+
+    def _get_cached_chapter_model(self, content: str) -> Optional[genai.GenerativeModel]:
+        """
+        为章节分割获取以 content 为显式上下文缓存的模型；内容过短或缓存不可用时返回None。
+
+        系统指令和Schema作为缓存的一部分，同一段文本在重复分析时只需上传一次。
+        """
+        with global_api_key(self._api_key):
+            cache = self._get_context_cache(self._chapter_prompt_prefix, content)
+        if not cache:
+            return None
+        return bind_model(genai.GenerativeModel.from_cached_content(cached_content=cache, generation_config=self.generation_config), self._api_key)
+
+    def _segment_full_text(self, full_text: str) -> Optional[BookChapters]:
+        """在一次调用中分析全书文本并分割章节，全文较长时使用显式上下文缓存。"""
         print(colored("\n🤔 正在分析全书以分割章节... (这可能需要几分钟)", "cyan"))
         try:
-            prompt = self._create_prompt(
-                system_instruction,
-                full_text,
-                BookChapters.model_json_schema()
-            )
-            response = model.generate_content(prompt)
+            cached_model = self._get_cached_chapter_model(full_text)
+            if cached_model:
+                response = cached_model.generate_content("请根据上面的全书文本分割章节。")
+            else:
+                prompt = self._chapter_prompt_prefix + full_text
+                response = self.model.generate_content(prompt)
             # 解析和验证JSON
             book_chapters = BookChapters.model_validate_json(response.text)
             
@@ -117,4 +456,50 @@ class BookAnalyzer:
             return book_chapters
         except Exception as e:
             print(colored(f"❌ 章节分割失败: {e}", "red"))
-            return None
\ No newline at end of file
+            return None
+
+    def segment_chapters(self, pdf_path: Path) -> Optional[BookChapters]:
+        """分析整本书以识别和分割章节 (同步入口)。"""
+        return asyncio.run(self.segment_chapters_async(pdf_path))
+
+    async def segment_chapters_async(self, pdf_path: Path) -> Optional[BookChapters]:
+        """
+        分析整本书以识别和分割章节。
+
+        全书不超过一个分块时一次性发送；否则切分成相互重叠的分块并发分析，再合并章节边界。
+        """
+        # PDF解析属于CPU密集型操作，放到线程中执行，避免阻塞事件循环
+        pages = await asyncio.to_thread(self._extract_pages, pdf_path)
+        chunks = self._chunk_pages(pages)
+        if len(chunks) <= 1:
+            full_text = "".join(f"\n\n[Page {i + 1}]\n\n{page_text}" for i, page_text in enumerate(pages))
+            return await asyncio.to_thread(self._segment_full_text, full_text)
+
+        semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+        async def _segment_chunk(start_page: int, end_page: int, chunk_text: str) -> List[Chapter]:
+            async with semaphore:
+                print(colored(f"🧩 正在分割第 {start_page} 页到 {end_page} 页的章节...", "cyan"))
+                chunk_note = (
+                    f"注意：这部分文本只是全书的一部分（第 {start_page} 页至第 {end_page} 页），与相邻部分之间有少量重叠。"
+                    "对于在开头或结尾被截断的章节，请仍然按照它在这部分文本中的实际页码范围返回。\n\n"
+                )
+                # 每个分块都超过显式缓存的下限时各自缓存，重复分析同一本书时不必再次上传分块文本
+                cached_model = await asyncio.to_thread(self._get_cached_chapter_model, chunk_text)
+                if cached_model:
+                    response = await cached_model.generate_content_async(chunk_note + "请根据上面的文本分割章节。")
+                else:
+                    # 分块说明放在固定前缀之后，所有分块共享同一个前缀
+                    response = await self.model.generate_content_async(self._chapter_prompt_prefix + chunk_note + chunk_text)
+                return BookChapters.model_validate_json(response.text).chapters
+
+        print(colored(f"\n🤔 全书较长，正在分成 {len(chunks)} 个部分并行分割章节...", "cyan"))
+        results = await asyncio.gather(*(_segment_chunk(*chunk) for chunk in chunks), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            print(colored(f"❌ 章节分割失败: {errors[0]}", "red"))
+            return None
+
+        book_chapters = BookChapters(chapters=self._merge_chapters([(chunk[0], chapters) for chunk, chapters in zip(chunks, results)]))
+        print(colored(f"✅ 章节分割成功! 共 {len(book_chapters.chapters)} 个章节。", "green"))
+        return book_chapters
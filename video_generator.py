@@ -6,23 +6,36 @@
 该模块包含VideoGenerator类，负责将文本章节转换为可视化视频。
 其工作流程包括：
 1. 使用Gemini API将章节文本分解为一系列可视化场景。
-2. 通过WebSocket API与ComfyUI服务通信，为每个场景生成视频片段。
-3. 使用moviepy将所有视频片段拼接成一个完整的视频。
+2. 通过HTTP接口一次性提交所有场景的工作流，并用一个长连接的WebSocket
+   并行接收ComfyUI的执行结果，为每个场景生成视频片段。
+3. 将所有视频片段拼接成一个完整的视频（优先使用ffmpeg直接复制码流）。
+
+相同工作流和提示词生成的视频片段会缓存在 temp_clips/cache/ 中重复使用。
 """
 
-import json
+import hashlib
+import heapq
+import os
+import shutil
+import subprocess
+import threading
 import time
 import uuid
 import requests
 import websocket
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Tuple
 
 import google.generativeai as genai
-from pydantic import BaseModel, Field
+import orjson
+from pydantic import BaseModel, Field, TypeAdapter
 from moviepy.editor import VideoFileClip, concatenate_videoclips
 from termcolor import colored
 
+from gemini_client import bind_model
+
 # --- Pydantic 模型定义 ---
 
 class Scene(BaseModel):
@@ -34,39 +47,99 @@ class ChapterScenes(BaseModel):
     """包含一个章节所有场景的列表"""
     scenes: List[Scene]
 
+# 批量分割时，响应是按章节顺序排列的 ChapterScenes 数组
+CHAPTER_SCENES_LIST = TypeAdapter(List[ChapterScenes])
+
+# 模型的JSON Schema在导入时序列化一次，所有提示词直接复用
+CHAPTER_SCENES_SCHEMA_JSON = orjson.dumps(ChapterScenes.model_json_schema(), option=orjson.OPT_INDENT_2).decode()
+CHAPTER_SCENES_LIST_SCHEMA_JSON = orjson.dumps(CHAPTER_SCENES_LIST.json_schema(), option=orjson.OPT_INDENT_2).decode()
+
+SCENE_SYSTEM_INSTRUCTION = """你是一位电影导演和故事板画师。你的任务是将下面的章节文本分解成一系列独立的、可视化的场景。
+            对于每个场景，完成两件事：
+            1.  `scene_description`: 用一句话简要描述这个场景的核心内容。
+            2.  `visual_prompt`: 创作一个详细、生动的提示词，供AI视频生成模型使用。这个提示词应该包含场景、角色、动作、情绪和艺术风格。例如："cinematic shot, Alice falling down a rabbit hole, swirling vortex of colors and objects, surreal, dreamlike, high detail"。
+            确保场景数量在5到10个之间，以保持视频节奏。"""
+
+# 下载线程数与HTTP连接池大小一致，保证每个下载线程都有可复用的连接
+HTTP_POOL_SIZE = 16
+# 流式下载视频片段时每次写入磁盘的块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+# 只有包含这些片段的WebSocket消息才需要解析；绝大多数进度消息可直接跳过
+WS_RESULT_MARKERS = ('"executed"', '"execution_error"', '"node": null', '"node":null')
+# WebSocket断开后重连前等待的秒数
+WS_RECONNECT_DELAY = 5
+# 断开后超过该秒数仍未能重新连接时放弃重连，让所有等待中的任务失败
+WS_RECONNECT_WINDOW = 120
+# ComfyUI按顺序执行任务，队列中第 k 个场景最多等待 k 倍该秒数
+SCENE_RESULT_TIMEOUT = 1800
+# 判断片段能否直接拼接（不重新编码）时需要一致的流参数
+STREAM_COPY_KEYS = ("codec_type", "codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "sample_rate", "channels")
+
+# 按 工作流哈希 + 场景提示词 缓存已生成的视频片段，总大小超过上限时淘汰最久未使用的片段
+CLIP_CACHE_DIR = Path("temp_clips") / "cache"
+CLIP_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+# 视频生成模式："final" 使用工作流的原始参数，"preview" 降低步数和分辨率以快速预览
+VIDEO_MODES = ("final", "preview")
+# 预览模式下需要降级的节点类型
+PREVIEW_SAMPLER_TYPES = ("KSampler", "KSamplerAdvanced")
+PREVIEW_LATENT_TYPES = ("EmptyLatentImage",)
+# 预览模式下潜空间的最小边长，宽高需保持为8的倍数
+PREVIEW_MIN_LATENT_SIZE = 64
+
 # --- 服务类 ---
 
 class VideoGenerator:
     """处理所有与视频生成相关的任务 (使用 google-generativeai)"""
+    # 工作流中接收场景提示词的节点标题
+    PROMPT_NODE_TITLE = "Prompt_Input_Node"
+
     def __init__(self, api_key: str, comfyui_address: str, workflow_path: Path):
-        genai.configure(api_key=api_key)
         self.model_name = "gemini-1.5-pro-latest"
         self.generation_config = genai.GenerationConfig(response_mime_type="application/json")
+        # 模型使用该密钥专属的客户端，并发会话之间不会互相覆盖密钥
+        self.model = bind_model(genai.GenerativeModel(self.model_name, generation_config=self.generation_config), api_key)
         
         self.server_address = comfyui_address
         self.client_id = str(uuid.uuid4())
+        self._http = requests.Session()
+        self._http.mount("http://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+        # prompt_id -> 等待ComfyUI执行结果的Future，由后台WebSocket线程完成
+        self._pending: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._ws_app: Optional[websocket.WebSocketApp] = None
+        self._ws_ready = threading.Event()
+        # 最近一次WebSocket连接建立的时间（time.monotonic），用于判断断线后是否重连成功过
+        self._ws_opened_at = 0.0
+        # 等待结果并下载视频片段的工作线程，多个片段的下载可以与后续场景的生成重叠
+        self._executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
         
         if not workflow_path.exists():
             raise FileNotFoundError(f"ComfyUI工作流文件未找到: {workflow_path}")
-        self.base_workflow = json.loads(workflow_path.read_text(encoding='utf-8'))
+        # 保留原始字节，每个场景从中解析出一份独立的工作流副本
+        self._workflow_bytes = workflow_path.read_bytes()
+        self.base_workflow = orjson.loads(self._workflow_bytes)
+        # 模式 -> (工作流字节, 工作流哈希)，预览模式的工作流在首次使用时生成
+        self._workflow_variants: Dict[str, Tuple[bytes, str]] = {
+            "final": (self._workflow_bytes, hashlib.sha256(self._workflow_bytes).hexdigest()[:12])
+        }
+        self._prompt_node_id = next(
+            (nid for nid, n in self.base_workflow.items() if n.get("_meta", {}).get("title") == self.PROMPT_NODE_TITLE), None
+        )
+        if not self._prompt_node_id:
+            raise ValueError(f"在工作流中找不到标题为 '{self.PROMPT_NODE_TITLE}' 的节点。")
 
-    def _create_prompt(self, system_instruction: str, user_content: str, schema: Dict) -> str:
-        """创建一个包含JSON schema的完整提示词"""
-        return f"{system_instruction}\n\n请严格按照下面的JSON Schema格式返回你的分析结果:\n{json.dumps(schema, indent=2)}\n\n需要分析的文本如下:\n---\n{user_content}"
+    def _create_prompt(self, system_instruction: str, user_content: str, schema_json: str) -> str:
+        """创建一个包含JSON schema的完整提示词，schema_json 为预先序列化好的Schema"""
+        return f"{system_instruction}\n\n请严格按照下面的JSON Schema格式返回你的分析结果:\n{schema_json}\n\n需要分析的文本如下:\n---\n{user_content}"
 
     def split_chapter_into_scenes(self, chapter_text: str) -> Optional[ChapterScenes]:
         """使用LLM将章节文本分割成一系列可视化场景"""
-        model = genai.GenerativeModel(self.model_name, generation_config=self.generation_config)
-        system_instruction = """你是一位电影导演和故事板画师。你的任务是将下面的章节文本分解成一系列独立的、可视化的场景。
-            对于每个场景，完成两件事：
-            1.  `scene_description`: 用一句话简要描述这个场景的核心内容。
-            2.  `visual_prompt`: 创作一个详细、生动的提示词，供AI视频生成模型使用。这个提示词应该包含场景、角色、动作、情绪和艺术风格。例如："cinematic shot, Alice falling down a rabbit hole, swirling vortex of colors and objects, surreal, dreamlike, high detail"。
-            确保场景数量在5到10个之间，以保持视频节奏。"""
 
         print(colored("\n🎬 正在将章节分割为可视化场景...", "cyan"))
         try:
-            prompt = self._create_prompt(system_instruction, chapter_text, ChapterScenes.model_json_schema())
-            response = model.generate_content(prompt)
+            prompt = self._create_prompt(SCENE_SYSTEM_INSTRUCTION, chapter_text, CHAPTER_SCENES_SCHEMA_JSON)
+            response = self.model.generate_content(prompt)
             scenes = ChapterScenes.model_validate_json(response.text)
             
             print(colored(f"✅ 成功将章节分割为 {len(scenes.scenes)} 个场景。", "green"))
@@ -74,73 +147,349 @@ class VideoGenerator:
         except Exception as e:
             print(colored(f"❌ 场景分割失败: {e}", "red"))
             return None
+
+    def split_chapters_into_scenes(self, chapters: List[str]) -> List[ChapterScenes]:
+        """在一次LLM调用中将多个章节分别分割成可视化场景，结果与输入章节一一对应"""
+        system_instruction = (
+            f"{SCENE_SYSTEM_INSTRUCTION}\n"
+            "下面的文本包含多个章节，每个章节以 `[[CHAPTER i]]` 标记开头。请对每个章节分别完成上述任务，"
+            "并按章节顺序返回一个JSON数组，数组的第i个元素对应第i个章节。"
+        )
+        chapters_text = "".join(f"\n\n[[CHAPTER {i + 1}]]\n\n{text}" for i, text in enumerate(chapters))
+
+        print(colored(f"\n🎬 正在将 {len(chapters)} 个章节批量分割为可视化场景...", "cyan"))
+        try:
+            prompt = self._create_prompt(system_instruction, chapters_text, CHAPTER_SCENES_LIST_SCHEMA_JSON)
+            response = self.model.generate_content(prompt)
+            chapter_scenes = CHAPTER_SCENES_LIST.validate_json(response.text)
+            if len(chapter_scenes) != len(chapters):
+                raise ValueError(f"返回了 {len(chapter_scenes)} 个章节的场景，预期为 {len(chapters)} 个。")
+
+            print(colored(f"✅ 成功将 {len(chapters)} 个章节分割为 {sum(len(c.scenes) for c in chapter_scenes)} 个场景。", "green"))
+            return chapter_scenes
+        except Exception as e:
+            print(colored(f"❌ 批量场景分割失败: {e}", "red"))
+            return []
     
-    def _queue_comfyui_prompt(self, prompt_workflow: Dict) -> Dict:
-        """将一个任务添加到ComfyUI队列中，并等待结果"""
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
-        ws.send(json.dumps({"prompt": prompt_workflow, "client_id": self.client_id}))
-        
-        print(colored("⏳ 等待ComfyUI生成视频片段...", "yellow"))
+    def _ensure_ws_listener(self) -> None:
+        """启动后台线程，通过一个长连接的WebSocket接收所有任务的执行消息"""
+        if self._ws_app is not None:
+            return
+        self._ws_app = websocket.WebSocketApp(
+            f"ws://{self.server_address}/ws?clientId={self.client_id}",
+            on_open=self._on_ws_open,
+            on_message=self._on_ws_message,
+        )
+        threading.Thread(target=self._run_ws_listener, args=(self._ws_app,), daemon=True).start()
+        if not self._ws_ready.wait(timeout=10):
+            ws_app, self._ws_app = self._ws_app, None
+            ws_app.close()
+            raise ConnectionError(f"无法连接到ComfyUI WebSocket: {self.server_address}")
+
+    def _run_ws_listener(self, ws_app: websocket.WebSocketApp) -> None:
+        """
+        运行WebSocket连接，断开后每隔 WS_RECONNECT_DELAY 秒重连。
+
+        websocket-client 自带的重连会无限重试且不触发任何回调，因此在这里自行重连：
+        断开超过 WS_RECONNECT_WINDOW 秒仍未连上，或连接被 close() 主动关闭时，让所有等待中的任务失败。
+        """
+        disconnected_at = None
         while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message['type'] == 'executed':
-                    ws.close()
-                    return message['data']['output']
-    
-    def _generate_clip_for_scene(self, scene_prompt: str, prompt_node_title: str) -> Optional[Path]:
-        """使用ComfyUI为单个场景生成视频片段"""
-        workflow = json.loads(json.dumps(self.base_workflow))
-        target_node_id = next((nid for nid, n in workflow.items() if n.get("_meta", {}).get("title") == prompt_node_title), None)
-        
-        if not target_node_id:
-            raise ValueError(f"在工作流中找不到标题为 '{prompt_node_title}' 的节点。")
-        
-        workflow[target_node_id]["inputs"]["text"] = scene_prompt
-        outputs = self._queue_comfyui_prompt(workflow)
+            ws_app.run_forever()
+            if ws_app is not self._ws_app:
+                self._fail_pending("连接已关闭")
+                return
+            now = time.monotonic()
+            if disconnected_at is None or self._ws_opened_at > disconnected_at:
+                disconnected_at = now  # 本次是新的断线，而不是重连失败
+            if now - disconnected_at > WS_RECONNECT_WINDOW:
+                print(colored(f"❌ {WS_RECONNECT_WINDOW} 秒内未能重新连接ComfyUI WebSocket，放弃等待中的任务。", "red"))
+                self._ws_ready.clear()
+                self._ws_app = None
+                self._fail_pending(f"{WS_RECONNECT_WINDOW} 秒内未能重新连接")
+                return
+            time.sleep(WS_RECONNECT_DELAY)
+
+    def _resolve_pending(self, prompt_id: Optional[str], result: Optional[Dict] = None, error: Optional[Exception] = None) -> None:
+        """完成指定任务的Future"""
+        with self._pending_lock:
+            future = self._pending.pop(prompt_id, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _on_ws_open(self, ws: websocket.WebSocketApp) -> None:
+        """连接建立时通知等待方；如果是断线重连，补查断线期间可能已经完成的任务"""
+        self._ws_opened_at = time.monotonic()
+        if self._ws_ready.is_set():
+            print(colored("🔌 已重新连接ComfyUI WebSocket，正在检查等待中的任务...", "yellow"))
+            threading.Thread(target=self._recover_pending, daemon=True).start()
+        self._ws_ready.set()
+
+    def _recover_pending(self) -> None:
+        """通过 /history 接口查询仍在等待的任务，完成那些已经执行结束的任务"""
+        with self._pending_lock:
+            pending_ids = list(self._pending)
+        for prompt_id in pending_ids:
+            try:
+                history = self._http.get(f"http://{self.server_address}/history/{prompt_id}").json()
+            except (requests.RequestException, ValueError):
+                continue
+            entry = history.get(prompt_id)
+            if not entry:
+                continue  # 任务尚未执行完毕，结果仍会通过WebSocket送达
+            if entry.get("status", {}).get("status_str") == "error":
+                self._resolve_pending(prompt_id, error=RuntimeError("ComfyUI执行失败"))
+            else:
+                outputs = {node: output for node, output in entry.get("outputs", {}).items() if 'videos' in output}
+                self._resolve_pending(prompt_id, result=outputs)
+
+    def _on_ws_message(self, ws: websocket.WebSocketApp, message) -> None:
+        """按 prompt_id 将ComfyUI的执行结果分发给对应的Future"""
+        if not isinstance(message, str):
+            return  # 二进制消息是预览帧，忽略
+        # 先在原始字符串上过滤，避免为每条进度消息做JSON解析
+        if not any(marker in message for marker in WS_RESULT_MARKERS):
+            return
+        message = orjson.loads(message)
+        data = message.get('data', {})
+        prompt_id = data.get('prompt_id')
+
+        if message['type'] == 'executed' and 'videos' in data.get('output', {}):
+            self._resolve_pending(prompt_id, result={data['node']: data['output']})
+        elif message['type'] == 'executing' and data.get('node') is None:
+            # 任务已结束但没有产生视频输出
+            self._resolve_pending(prompt_id, result={})
+        elif message['type'] == 'execution_error':
+            self._resolve_pending(prompt_id, error=RuntimeError(f"ComfyUI执行失败: {data.get('exception_message')}"))
+
+    def _fail_pending(self, reason: str) -> None:
+        """连接不再可用时让所有仍在等待的任务失败，避免调用方永久阻塞"""
+        with self._pending_lock:
+            pending_ids = list(self._pending)
+        for prompt_id in pending_ids:
+            self._resolve_pending(prompt_id, error=ConnectionError(f"ComfyUI WebSocket连接已断开: {reason}"))
+
+    def _submit(self, prompt_workflow: Dict) -> Future:
+        """通过HTTP接口将任务加入ComfyUI队列，返回在任务执行完毕时得到输出的Future"""
+        future = Future()
+        # 持有锁直到Future注册完成，保证执行结果不会早于注册到达
+        with self._pending_lock:
+            response = self._http.post(
+                f"http://{self.server_address}/prompt",
+                data=orjson.dumps({"prompt": prompt_workflow, "client_id": self.client_id}),
+                headers={"Content-Type": "application/json"},
+            )
+            response.raise_for_status()
+            self._pending[response.json()['prompt_id']] = future
+        return future
+
+    def _find_cached_clip(self, cache_key: str) -> Optional[Path]:
+        """查找已缓存的视频片段，命中时刷新其访问时间"""
+        cached_clip = next(CLIP_CACHE_DIR.glob(f"{cache_key}.*"), None)
+        if cached_clip:
+            os.utime(cached_clip)
+        return cached_clip
+
+    def _store_cached_clip(self, clip_path: Path, cache_key: str) -> None:
+        """将新生成的视频片段复制到缓存目录，并在超出容量时淘汰最久未使用的片段"""
+        CLIP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        shutil.copy(clip_path, CLIP_CACHE_DIR / f"{cache_key}{clip_path.suffix}")
+
+        entries = []
+        for path in CLIP_CACHE_DIR.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # 已被其他线程淘汰
+            entries.append((stat.st_atime, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        heapq.heapify(entries)
+        while total_bytes > CLIP_CACHE_MAX_BYTES and entries:
+            _, size, path = heapq.heappop(entries)
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def _download_clip(self, prompt_future: Future, cache_key: str, timeout: Optional[float] = None) -> Optional[Path]:
+        """等待任务执行完毕（最多 timeout 秒）并下载生成的视频片段"""
+        print(colored("⏳ 等待ComfyUI生成视频片段...", "yellow"))
+        outputs = prompt_future.result(timeout=timeout)
         
         for node_id in outputs:
             if 'videos' in outputs[node_id]:
                 video_data = outputs[node_id]['videos'][0]
                 url = f"http://{self.server_address}/view?subfolder={video_data.get('subfolder', '')}&filename={video_data['filename']}"
-                response = requests.get(url, stream=True)
-                if response.status_code == 200:
-                    output_dir = Path("temp_clips")
-                    output_dir.mkdir(exist_ok=True)
-                    clip_path = output_dir / video_data['filename']
-                    clip_path.write_bytes(response.content)
-                    print(colored(f"\n✅ 视频片段已保存: {clip_path}", "green"))
-                    return clip_path
+                with self._http.get(url, stream=True) as response:
+                    if response.status_code == 200:
+                        output_dir = Path("temp_clips")
+                        output_dir.mkdir(exist_ok=True)
+                        clip_path = output_dir / video_data['filename']
+                        # 分块写入磁盘，避免把整个视频片段读入内存
+                        with clip_path.open("wb") as f:
+                            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                        print(colored(f"\n✅ 视频片段已保存: {clip_path}", "green"))
+                        self._store_cached_clip(clip_path, cache_key)
+                        return clip_path
         return None
+    
+    def _find_fp8_checkpoint(self, ckpt_name: str) -> Optional[str]:
+        """在ComfyUI可用的模型中查找与给定checkpoint对应的fp8版本"""
+        try:
+            object_info = self._http.get(f"http://{self.server_address}/object_info/CheckpointLoaderSimple").json()
+            available = object_info["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"][0]
+        except (requests.RequestException, ValueError, KeyError, IndexError):
+            return None
+        stem = Path(ckpt_name).stem
+        return next((name for name in available if name != ckpt_name and name.startswith(stem) and "fp8" in name[len(stem):].lower()), None)
+
+    def _apply_preview_settings(self, workflow: Dict) -> None:
+        """将工作流降级为预览参数：采样步数减半、潜空间宽高减半、模型改用fp8精度"""
+        for node in workflow.values():
+            class_type = node.get("class_type")
+            inputs = node.get("inputs", {})
+            # 输入也可能是指向其他节点的连接 [node_id, index]，只修改字面值
+            if class_type in PREVIEW_SAMPLER_TYPES and isinstance(inputs.get("steps"), int):
+                inputs["steps"] = max(1, inputs["steps"] // 2)
+            elif class_type in PREVIEW_LATENT_TYPES:
+                for key in ("width", "height"):
+                    if isinstance(inputs.get(key), int):
+                        inputs[key] = max(PREVIEW_MIN_LATENT_SIZE, inputs[key] // 2 // 8 * 8)
+            elif class_type == "UNETLoader" and "weight_dtype" in inputs:
+                inputs["weight_dtype"] = "fp8_e4m3fn"
+            elif class_type == "CheckpointLoaderSimple" and isinstance(inputs.get("ckpt_name"), str):
+                fp8_ckpt = self._find_fp8_checkpoint(inputs["ckpt_name"])
+                if fp8_ckpt:
+                    inputs["ckpt_name"] = fp8_ckpt
+
+    def _get_workflow_variant(self, mode: str) -> Tuple[bytes, str]:
+        """返回指定模式下的工作流字节及其哈希"""
+        if mode not in VIDEO_MODES:
+            raise ValueError(f"不支持的视频生成模式: '{mode}'，可选值为 {VIDEO_MODES}。")
+        if mode not in self._workflow_variants:
+            workflow = orjson.loads(self._workflow_bytes)
+            self._apply_preview_settings(workflow)
+            workflow_bytes = orjson.dumps(workflow)
+            self._workflow_variants[mode] = (workflow_bytes, hashlib.sha256(workflow_bytes).hexdigest()[:12])
+        return self._workflow_variants[mode]
+
+    def _generate_clip_for_scene(self, scene_prompt: str, mode: str = "final", timeout: Optional[float] = None) -> Future:
+        """提交单个场景的ComfyUI任务，返回最终得到视频片段路径的Future；已缓存的片段直接返回，timeout 为等待执行结果的上限"""
+        workflow_bytes, workflow_hash = self._get_workflow_variant(mode)
+        cache_key = hashlib.sha256((workflow_hash + scene_prompt).encode("utf-8")).hexdigest()
+        cached_clip = self._find_cached_clip(cache_key)
+        if cached_clip:
+            print(colored(f"♻️ 使用已缓存的视频片段: {cached_clip}", "blue"))
+            clip_future = Future()
+            clip_future.set_result(cached_clip)
+            return clip_future
+
+        workflow = orjson.loads(workflow_bytes)
+        workflow[self._prompt_node_id]["inputs"]["text"] = scene_prompt
+        prompt_future = self._submit(workflow)
+        return self._executor.submit(self._download_clip, prompt_future, cache_key, timeout)
+
+    def _probe_stream_params(self, clip_path: Path) -> List[tuple]:
+        """使用ffprobe读取片段中每个流的编码参数"""
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_streams", "-of", "json", str(clip_path)],
+            capture_output=True, check=True,
+        )
+        streams = orjson.loads(result.stdout).get("streams", [])
+        return [tuple(stream.get(key) for key in STREAM_COPY_KEYS) for stream in streams]
+
+    def _can_stream_copy(self, clip_paths: List[Path]) -> bool:
+        """判断所有片段是否为相同编码参数的MP4，从而可以不经重新编码直接拼接"""
+        if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+            return False
+        if any(p.suffix.lower() != ".mp4" for p in clip_paths):
+            return False
+        try:
+            params = [self._probe_stream_params(p) for p in clip_paths]
+        except (OSError, subprocess.CalledProcessError, orjson.JSONDecodeError):
+            return False
+        return all(p == params[0] for p in params)
+
+    def _concat_with_ffmpeg(self, clip_paths: List[Path], final_path: Path) -> None:
+        """使用ffmpeg的concat demuxer按流复制的方式拼接片段"""
+        concat_list = final_path.with_suffix(".txt")
+        # concat列表中路径里的单引号需要转义为 '\''
+        escaped_paths = [str(p.resolve()).replace("'", "'\\''") for p in clip_paths]
+        concat_list.write_text("".join(f"file '{path}'\n" for path in escaped_paths), encoding='utf-8')
+        try:
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(final_path)],
+                check=True,
+            )
+        finally:
+            concat_list.unlink(missing_ok=True)
 
-    def _stitch_clips_into_video(self, clip_paths: List[Path], output_filename: str) -> Path:
-        """将视频片段拼接成一个完整的视频"""
+    def _stitch_clips_into_video(self, clip_paths: List[Path], output_filename: str, stream_copy: bool = True) -> Path:
+        """
+        将视频片段拼接成一个完整的视频。
+
+        所有片段编码参数一致时，使用ffmpeg直接复制码流，无需重新编码；
+        否则（或 stream_copy 为False时）回退到moviepy重新合成并编码。
+        """
         print(colored("\n🎞️ 正在拼接所有视频片段...", "cyan"))
-        clips = [VideoFileClip(str(p)) for p in clip_paths]
-        final_clip = concatenate_videoclips(clips, method="compose")
-        
         output_dir = Path("final_videos")
         output_dir.mkdir(exist_ok=True)
         final_path = output_dir / f"{output_filename}.mp4"
-        
-        # *** 修正 ***: 将错误的 'libx24' 修正为正确的 'libx264'
-        final_clip.write_videofile(str(final_path), codec="libx264", audio_codec="aac")
+
+        copied = False
+        if stream_copy and self._can_stream_copy(clip_paths):
+            try:
+                self._concat_with_ffmpeg(clip_paths, final_path)
+                copied = True
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(colored(f"⚠️ ffmpeg直接拼接失败，改用moviepy重新编码: {e}", "yellow"))
+
+        if not copied:
+            clips = [VideoFileClip(str(p)) for p in clip_paths]
+            final_clip = concatenate_videoclips(clips, method="compose")
+            # *** 修正 ***: 将错误的 'libx24' 修正为正确的 'libx264'
+            final_clip.write_videofile(str(final_path), codec="libx264", audio_codec="aac")
+            for clip in clips: clip.close()
         print(colored(f"✅ 最终视频已生成: {final_path}", "green"))
 
-        for p in clip_paths: p.unlink()
+        # 只清理临时片段，缓存中的片段保留供下次复用
+        for p in clip_paths:
+            if p.parent != CLIP_CACHE_DIR: p.unlink(missing_ok=True)
         return final_path
 
-    def create_chapter_video(self, chapter_text: str, output_filename: str = "chapter_video") -> Optional[Path]:
-        """创建章节视频的完整流程。"""
-        scenes_data = self.split_chapter_into_scenes(chapter_text)
-        if not scenes_data or not scenes_data.scenes: return None
-        
+    def _render_scenes(
+        self, scenes: List[Scene], output_filename: str, mode: str = "final", progress_callback: Optional[Callable[[str], None]] = None
+    ) -> Optional[Path]:
+        """为所有场景生成视频片段并拼接成最终视频；每完成一个场景都会通过 progress_callback 报告进度。"""
+        report = progress_callback or (lambda message: None)
+        # 先把所有场景一次性提交到ComfyUI队列，再并行收集结果
+        self._ensure_ws_listener()
+        print(colored(f"\n🚀 正在以 {mode} 模式提交 {len(scenes)} 个场景到ComfyUI队列...", "magenta"))
+        clip_futures = [
+            self._generate_clip_for_scene(scene.visual_prompt, mode, timeout=SCENE_RESULT_TIMEOUT * (i + 1)) for i, scene in enumerate(scenes)
+        ]
+        report(f"🚀 已提交 {len(scenes)} 个场景到ComfyUI队列")
+
+        scene_of = {clip_future: scene for clip_future, scene in zip(clip_futures, scenes)}
+        try:
+            # 每个场景的等待已有上限，这里的总超时只是兜底，额外留出下载时间
+            for done_count, clip_future in enumerate(as_completed(clip_futures, timeout=SCENE_RESULT_TIMEOUT * (len(scenes) + 1)), start=1):
+                status = "❌ 失败" if clip_future.exception() else "✅ 完成"
+                report(f"{status} ({done_count}/{len(scenes)}): {scene_of[clip_future].scene_description}")
+        except FutureTimeoutError:
+            report("⚠️ 等待ComfyUI超时，未完成的场景将被跳过")
+
         clip_paths = []
-        for i, scene in enumerate(scenes_data.scenes):
-            print(colored(f"\n🎬 正在生成场景 {i+1}/{len(scenes_data.scenes)}: '{scene.scene_description}'", "magenta"))
-            clip_path = self._generate_clip_for_scene(scene.visual_prompt, "Prompt_Input_Node")
+        for i, (scene, clip_future) in enumerate(zip(scenes, clip_futures)):
+            try:
+                # 上面已经等待过所有场景，此时仍未完成的视为超时失败
+                clip_path = clip_future.result(timeout=0)
+            except Exception as e:
+                print(colored(f"❌ 场景 {i+1}/{len(scenes)} '{scene.scene_description}' 生成失败: {e}", "red"))
+                continue
             if clip_path:
                 clip_paths.append(clip_path)
 
@@ -148,4 +497,42 @@ class VideoGenerator:
             print(colored("❌ 未能生成任何视频片段，无法创建最终视频。", "red"))
             return None
             
-        return self._stitch_clips_into_video(clip_paths, output_filename)
\ No newline at end of file
+        report(f"🎞️ 正在拼接 {len(clip_paths)} 个视频片段...")
+        return self._stitch_clips_into_video(clip_paths, output_filename)
+
+    def create_chapter_video(
+        self, chapter_text: str, output_filename: str = "chapter_video", mode: str = "final",
+        progress_callback: Optional[Callable[[str], None]] = None,
+    ) -> Optional[Path]:
+        """
+        创建章节视频的完整流程。
+
+        mode 为 "preview" 时使用降级的工作流参数快速生成预览，"final" 时使用原始参数。
+        progress_callback 会在各个阶段和每个场景完成时收到一条进度消息（可能在工作线程中调用）。
+        """
+        scenes_data = self.split_chapter_into_scenes(chapter_text)
+        if not scenes_data or not scenes_data.scenes: return None
+        if progress_callback: progress_callback(f"🎬 已将章节分割为 {len(scenes_data.scenes)} 个场景")
+        return self._render_scenes(scenes_data.scenes, output_filename, mode, progress_callback)
+
+    def create_chapters_video(
+        self, chapter_texts: List[str], output_filename: str = "chapters_video", mode: str = "final",
+        progress_callback: Optional[Callable[[str], None]] = None,
+    ) -> Optional[Path]:
+        """将多个章节按顺序生成为一个视频，场景分割只需一次LLM调用。"""
+        if len(chapter_texts) == 1:
+            return self.create_chapter_video(chapter_texts[0], output_filename, mode, progress_callback)
+        chapter_scenes = self.split_chapters_into_scenes(chapter_texts)
+        scenes = [scene for chapter in chapter_scenes for scene in chapter.scenes]
+        if not scenes: return None
+        if progress_callback: progress_callback(f"🎬 已将 {len(chapter_texts)} 个章节分割为 {len(scenes)} 个场景")
+        return self._render_scenes(scenes, output_filename, mode, progress_callback)
+
+    def close(self) -> None:
+        """关闭WebSocket长连接、工作线程池和HTTP会话"""
+        if self._ws_app is not None:
+            # 先清空引用，后台线程据此区分主动关闭和意外断线
+            ws_app, self._ws_app = self._ws_app, None
+            ws_app.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._http.close()
\ No newline at end of file